@@ -5,13 +5,18 @@ Cloudflare Request Cert - SSL/TLS certificate automation using Cloudflare DNS
 
 from __future__ import annotations
 
-import argparse
+import functools
 import logging
 import os
-import subprocess
+import re
 import sys
+from collections import ChainMap
+from collections.abc import Iterator, Mapping
 from pathlib import Path
-from typing import TypedDict
+from typing import TYPE_CHECKING, NamedTuple, TypedDict
+
+if TYPE_CHECKING:
+    import argparse
 
 
 class Config(TypedDict):
@@ -20,28 +25,107 @@ class Config(TypedDict):
     api_token: str | None
     staging: bool
     propagation_seconds: int
+    verbose: bool
+    force_issue: bool
+
+
+class _FastArgs(NamedTuple):
+    """Parsed-args stand-in for a bare invocation with no CLI arguments."""
+
+    env_file: Path = Path(".env")
+    domain: str | None = None
+    email: str | None = None
+    staging: bool = False
+    propagation_seconds: int | None = None
+    verbose: bool = False
+    force_issue: bool = False
+
+
+# The "= value" half of a .env line, shared by the full and per-key parsers.
+# Surrounding whitespace is dropped; quotes are stripped by _decode_value.
+_ENV_VALUE = rb"[ \t]*=[ \t]*(.*?)[ \t\r]*$"
+
+# KEY=value pairs
+_ENV_RE = re.compile(rb"(?m)^[ \t]*([A-Za-z_][A-Za-z0-9_]*)" + _ENV_VALUE)
+
+# Where certbot keeps issued certificates, one directory per certificate name
+_LIVE_DIR = "/etc/letsencrypt/live"
+
+# Where certbot keeps the <name>.conf renewal settings for each certificate
+_RENEWAL_DIR = "/etc/letsencrypt/renewal"
+
+# The ACME server a certificate was issued from, as stored in its renewal config
+_SERVER_RE = re.compile(r"(?m)^[ \t]*server[ \t]*=[ \t]*(\S+)")
+
+
+def _decode_value(raw: bytes) -> str:
+    return raw.strip(b"\"'").decode("utf-8", "replace")
+
+
+def _read_env_bytes(env_file: Path) -> bytes:
+    """Read the whole .env file in one call; a missing file reads as empty."""
+    try:
+        return env_file.read_bytes()
+    except FileNotFoundError:
+        return b""
 
 
 def load_env_file(env_file: Path) -> dict[str, str]:
     """Load environment variables from a .env file."""
-    env_vars: dict[str, str] = {}
-    if env_file.exists():
-        with env_file.open() as f:
-            for line in f:
-                line = line.strip()
-                if line and not line.startswith("#"):
-                    key, _, value = line.partition("=")
-                    env_vars[key.strip()] = value.strip().strip("\"'")
-    logging.debug("Loaded environment variables: %s", env_vars)
-
-    return env_vars
+    return {
+        key.decode("utf-8", "replace"): _decode_value(value)
+        for key, value in _ENV_RE.findall(_read_env_bytes(env_file))
+    }
 
 
-def load_config() -> Config:
+class EnvView(Mapping[str, str]):
     """
-    Parse CLI args + env file + environment variables
-    and return a merged config dictionary.
+    Read-only view of a .env file that only extracts the keys asked for.
+
+    The file is read on first access and each lookup runs a search for that
+    key alone, memoizing the result. Keys with an empty value are treated as
+    unset so lookups fall through to the next source in load_config.
     """
+
+    def __init__(self, env_file: Path) -> None:
+        self._env_file = env_file
+        self._buf: bytes | None = None
+        self._cache: dict[str, str | None] = {}
+
+    def _data(self) -> bytes:
+        if self._buf is None:
+            self._buf = _read_env_bytes(self._env_file)
+        return self._buf
+
+    def __getitem__(self, key: str) -> str:
+        try:
+            value = self._cache[key]
+        except KeyError:
+            pattern = rb"(?m)^[ \t]*" + re.escape(key.encode()) + _ENV_VALUE
+            value = None
+            # Later assignments win, as with load_env_file
+            for m in re.finditer(pattern, self._data()):
+                value = _decode_value(m.group(1)) or None
+            self._cache[key] = value
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __iter__(self) -> Iterator[str]:
+        keys = dict.fromkeys(
+            key.decode("utf-8", "replace") for key, _ in _ENV_RE.findall(self._data())
+        )
+        return (key for key in keys if key in self)
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+
+@functools.lru_cache(maxsize=1)
+def _get_parser() -> argparse.ArgumentParser:
+    """Build the CLI argument parser once and reuse it."""
+    import argparse
+
     parser = argparse.ArgumentParser(
         description="Request SSL/TLS certificates using Cloudflare DNS"
     )
@@ -49,25 +133,48 @@ def load_config() -> Config:
     parser.add_argument("-e", "--email")
     parser.add_argument("--staging", action="store_true")
     parser.add_argument("--propagation-seconds", type=int)
+    parser.add_argument("--verbose", action="store_true")
+    parser.add_argument("--force-issue", action="store_true")
     parser.add_argument(
         "--env-file",
         type=Path,
         default=Path(".env"),
     )
 
-    args = parser.parse_args()
-    env_vars = load_env_file(args.env_file)
+    return parser
+
+
+def load_config() -> Config:
+    """
+    Parse CLI args + env file + environment variables
+    and return a merged config dictionary.
+    """
+    # A bare invocation (typically from cron) has nothing to parse, so skip
+    # importing and building argparse altogether
+    args = _FastArgs() if len(sys.argv) == 1 else _get_parser().parse_args()
+    env_vars = EnvView(args.env_file)
+
+    # Highest priority first: CLI args, then the .env file, then the environment
+    cli = {
+        key: value
+        for key, value in (
+            ("DOMAIN", args.domain),
+            ("EMAIL", args.email),
+            ("STAGING", "1" if args.staging else None),
+            ("PROPAGATION_SECONDS", args.propagation_seconds),
+        )
+        if value is not None
+    }
+    settings = ChainMap(cli, env_vars, os.environ)
 
     config: Config = {
-        "domain": args.domain or env_vars.get("DOMAIN") or os.getenv("DOMAIN"),
-        "email": args.email or env_vars.get("EMAIL") or os.getenv("EMAIL"),
-        "api_token": env_vars.get("CLOUDFLARE_API_TOKEN") or os.getenv("CLOUDFLARE_API_TOKEN"),
-        "staging": (args.staging or env_vars.get("STAGING") == "1" or os.getenv("STAGING") == "1"),
-        "propagation_seconds": (
-            args.propagation_seconds or int(env_vars.get("PROPAGATION_SECONDS", "10"))
-            if env_vars.get("PROPAGATION_SECONDS")
-            else (args.propagation_seconds or 10)
-        ),
+        "domain": settings.get("DOMAIN"),
+        "email": settings.get("EMAIL"),
+        "api_token": settings.get("CLOUDFLARE_API_TOKEN"),
+        "staging": settings.get("STAGING") == "1",
+        "propagation_seconds": int(settings.get("PROPAGATION_SECONDS") or 10),
+        "verbose": args.verbose,
+        "force_issue": args.force_issue,
     }
 
     return config
@@ -76,73 +183,187 @@ def load_config() -> Config:
 def validate_credentials(api_token: str | None) -> bool:
     """Validate that required credentials are present."""
     if not api_token:
-        print("Error: CLOUDFLARE_API_TOKEN is required", file=sys.stderr)
-        print("\nPlease set it in one of these ways:", file=sys.stderr)
-        print("1. Create a .env file with: CLOUDFLARE_API_TOKEN=your_token", file=sys.stderr)
-        print("2. Export it: export CLOUDFLARE_API_TOKEN=your_token", file=sys.stderr)
+        sys.stderr.write(
+            "Error: CLOUDFLARE_API_TOKEN is required\n"
+            "\nPlease set it in one of these ways:\n"
+            "1. Create a .env file with: CLOUDFLARE_API_TOKEN=your_token\n"
+            "2. Export it: export CLOUDFLARE_API_TOKEN=your_token\n"
+        )
         return False
     return True
 
 
+@functools.cache
+def _creds_dir() -> str:
+    """Directory holding the certbot Cloudflare credentials file."""
+    return os.path.join(os.path.expanduser("~"), ".secrets", "certbot")
+
+
+@functools.cache
+def _certbot_path() -> str:
+    """Detect the correct certbot path (checks venv bin first)."""
+    certbot_bin = Path(sys.executable).parent / "certbot"
+    return str(certbot_bin) if certbot_bin.exists() else "certbot"
+
+
+@functools.lru_cache
+def _certbot_prefix(staging: bool, propagation_seconds: int, verbose: bool) -> tuple[str, ...]:
+    """The part of the certbot command line that does not depend on the domain."""
+    prefix = (
+        _certbot_path(),
+        "certonly",
+        "--dns-cloudflare",
+        "--dns-cloudflare-propagation-seconds",
+        str(propagation_seconds),
+        "--agree-tos",
+        "--non-interactive",
+    )
+    if staging:
+        prefix += ("--staging",)
+    # --quiet silences certbot's progress output (errors are still printed);
+    # success or failure is still reported through the exit code
+    if not verbose:
+        prefix += ("--quiet",)
+    return prefix
+
+
+def _lineage_is_staging(domain: str) -> bool | None:
+    """
+    Whether the existing certificate for domain was issued by the staging CA.
+
+    Returns None if its renewal config cannot be read or names no server.
+    """
+    try:
+        with open(os.path.join(_RENEWAL_DIR, f"{domain}.conf")) as f:
+            m = _SERVER_RE.search(f.read())
+    except OSError:
+        return None
+    if m is None:
+        return None
+    return "acme-staging" in m.group(1)
+
+
+def _spawn_certbot(cmd: list[str]) -> int:
+    """
+    Run certbot with inherited stdio and return its exit code.
+
+    posix_spawn lets the C library use vfork/CLONE_VM instead of copying
+    the parent's page tables. Raises FileNotFoundError if cmd[0] is missing.
+    """
+    pid = os.posix_spawnp(cmd[0], cmd, os.environ)
+    _, status = os.waitpid(pid, 0)
+    return os.waitstatus_to_exitcode(status)
+
+
 def request_certificate(
     domain: str,
     email: str,
     api_token: str,
     staging: bool = False,
     propagation_seconds: int = 10,
+    verbose: bool = False,
+    force_issue: bool = False,
 ) -> int:
-    """Request or renew a certificate using certbot with Cloudflare DNS."""
-    credentials_dir = Path.home() / ".secrets" / "certbot"
-    credentials_dir.mkdir(parents=True, exist_ok=True, mode=0o700)
-    credentials_file = credentials_dir / "cloudflare.ini"
+    """
+    Request or renew a certificate using certbot with Cloudflare DNS.
 
-    credentials_file.write_text(f"dns_cloudflare_api_token = {api_token}\n")
-    credentials_file.chmod(0o600)
+    If a certificate for the domain already exists and was issued by the
+    same CA (staging or production) as requested, `certbot renew` is run for
+    it instead, which skips the DNS-01 challenge unless the certificate is
+    due. Pass force_issue=True to always go through `certbot certonly`.
+    """
+    creds_dir = _creds_dir()
+    os.makedirs(creds_dir, mode=0o700, exist_ok=True)
+    credentials_file = os.path.join(creds_dir, "cloudflare.ini")
 
-    # Detect the correct certbot path (checks venv bin first)
-    python_bin_dir = Path(sys.executable).parent
-    certbot_bin = python_bin_dir / "certbot"
-    certbot_path = str(certbot_bin) if certbot_bin.exists() else "certbot"
+    # The file is kept between runs: the renewal config certbot writes points
+    # at it, so `certbot renew` needs it to still exist. Only touch it when
+    # the token changed, and keep it current on renewals too so a rotated
+    # token reaches certbot.
+    credentials = f"dns_cloudflare_api_token = {api_token}\n".encode()
+    try:
+        with open(credentials_file, "rb") as f:
+            existing = f.read()
+            loose_mode = os.fstat(f.fileno()).st_mode & 0o077
+    except FileNotFoundError:
+        existing, loose_mode = None, 0
+    if existing != credentials:
+        # Created 0600 by os.open() itself, so the token is never
+        # readable by others; fchmod covers a pre-existing file with a looser mode.
+        fd = os.open(credentials_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            os.fchmod(fd, 0o600)
+            os.write(fd, credentials)
+        finally:
+            os.close(fd)
+    elif loose_mode:
+        # Same token, but group/others can read it: tighten it since it stays on disk
+        os.chmod(credentials_file, 0o600)
 
-    cmd = [
-        certbot_path,
-        "certonly",
-        "--dns-cloudflare",
-        "--dns-cloudflare-credentials",
-        str(credentials_file),
-        "--dns-cloudflare-propagation-seconds",
-        str(propagation_seconds),
-        "-d",
-        domain,
-        "--email",
-        email,
-        "--agree-tos",
-        "--non-interactive",
-    ]
+    live_dir = os.path.join(_LIVE_DIR, domain)
+    has_lineage = os.path.exists(os.path.join(live_dir, "fullchain.pem"))
+    lineage_staging = _lineage_is_staging(domain) if has_lineage else None
+    renew = not force_issue and lineage_staging is not None and lineage_staging == staging
 
-    if staging:
-        cmd.append("--staging")
+    # certbot refuses to replace a valid production certificate with a staging
+    # one (short of --break-my-certs), and certonly would quietly keep it
+    if staging and lineage_staging is False:
+        sys.stderr.write(
+            f"✗ A production certificate for {domain} already exists in {live_dir}/\n"
+            "certbot will not replace it with a staging certificate. Either run without\n"
+            "--staging, or remove the production certificate first:\n"
+            f"  certbot delete --cert-name {domain}\n"
+        )
+        return 1
 
-    print(f"Requesting certificate for {domain}...")
-    print(f"Using Cloudflare API (propagation wait: {propagation_seconds}s)")
-    if staging:
-        print("⚠️  Using STAGING environment (test certificates)")
+    if renew:
+        cmd = [_certbot_path(), "renew", "--cert-name", domain, "--non-interactive"]
+        if not verbose:
+            cmd.append("--quiet")
+
+        print(f"Renewing existing certificate for {domain}...")
+        print(
+            "Using the settings certbot stored for it (email and propagation wait "
+            "are ignored; use --force-issue to apply them)"
+        )
+    else:
+        cmd = [
+            *_certbot_prefix(staging, propagation_seconds, verbose),
+            "--dns-cloudflare-credentials",
+            credentials_file,
+            "-d",
+            domain,
+            "--email",
+            email,
+        ]
+        # With an existing certificate for the domain, certonly --non-interactive
+        # keeps it unless it is due. Force a new one when asked to, and when
+        # replacing a staging certificate (never due) with a production one.
+        if has_lineage and (force_issue or (lineage_staging and not staging)):
+            cmd.append("--force-renewal")
+
+        print(f"Requesting certificate for {domain}...")
+        print(f"Using Cloudflare API (propagation wait: {propagation_seconds}s)")
+        if staging:
+            print("⚠️  Using STAGING environment (test certificates)")
 
     try:
-        subprocess.run(cmd, check=True)
-        print(f"\n✓ Certificate successfully obtained for {domain}")
-        print(f"Certificate location: /etc/letsencrypt/live/{domain}/")
+        returncode = _spawn_certbot(cmd)
+        if returncode != 0:
+            print(
+                f"\n✗ Failed to obtain certificate: certbot exited with status {returncode}",
+                file=sys.stderr,
+            )
+            return 1
+        if renew:
+            print(f"\n✓ Certificate for {domain} is up to date")
+        else:
+            print(f"\n✓ Certificate successfully obtained for {domain}")
+        print(f"Certificate location: {live_dir}/")
         return 0
-    except subprocess.CalledProcessError as e:
-        print(f"\n✗ Failed to obtain certificate: {e}", file=sys.stderr)
-        return 1
     except FileNotFoundError:
-        print("\n✗ certbot not found. Please install it first:", file=sys.stderr)
-        print("  make install", file=sys.stderr)
+        sys.stderr.write("\n✗ certbot not found. Please install it first:\n  make install\n")
         return 1
-    finally:
-        if credentials_file.exists():
-            credentials_file.unlink()
 
 
 def main() -> int:
@@ -173,6 +394,8 @@ def main() -> int:
         api_token=config["api_token"],  # type: ignore[arg-type]
         staging=config["staging"],
         propagation_seconds=config["propagation_seconds"],
+        verbose=config["verbose"],
+        force_issue=config["force_issue"],
     )
 
 
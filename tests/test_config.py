@@ -1,3 +1,4 @@
+import logging
 import textwrap
 from pathlib import Path
 
@@ -40,3 +41,105 @@ def test_load_config_success(monkeypatch, tmp_path):
     assert config["api_token"] == "abc123"
     assert config["propagation_seconds"] == 10
     assert config["staging"] is False
+    assert config["verbose"] is False
+
+
+def test_load_env_file_missing(tmp_path: Path):
+    assert c.load_env_file(tmp_path / "missing.env") == {}
+
+
+def test_load_env_file_quotes_and_whitespace(tmp_path: Path):
+    env = tmp_path / ".env"
+    env.write_bytes(b"  DOMAIN = \"example.com\"  \r\nEMAIL='admin@example.com'\n#TOKEN=x\n")
+
+    result = c.load_env_file(env)
+
+    assert result == {"DOMAIN": "example.com", "EMAIL": "admin@example.com"}
+
+
+def test_load_config_priority(monkeypatch, tmp_path):
+    env = tmp_path / ".env"
+    env.write_text("DOMAIN=file.example.com\nEMAIL=file@example.com\nSTAGING=1\n")
+
+    monkeypatch.setenv("DOMAIN", "env.example.com")
+    monkeypatch.setenv("EMAIL", "env@example.com")
+    monkeypatch.setenv("PROPAGATION_SECONDS", "30")
+
+    monkeypatch.setattr("sys.argv", ["prog", "--env-file", str(env), "-d", "cli.example.com"])
+
+    config = c.load_config()
+
+    assert config["domain"] == "cli.example.com"
+    assert config["email"] == "file@example.com"
+    assert config["staging"] is True
+    assert config["propagation_seconds"] == 30
+
+
+def test_load_config_cli_propagation_seconds(monkeypatch, tmp_path):
+    env = tmp_path / ".env"
+    env.write_text("PROPAGATION_SECONDS=20\n")
+
+    monkeypatch.setattr("sys.argv", ["prog", "--env-file", str(env), "--propagation-seconds", "45"])
+
+    assert c.load_config()["propagation_seconds"] == 45
+
+
+def test_env_view(tmp_path: Path):
+    env = tmp_path / ".env"
+    env.write_text("DOMAIN=first.example.com\nEMAIL=\nDOMAIN='example.com'\nSTAGING=1\n")
+
+    view = c.EnvView(env)
+
+    assert view["DOMAIN"] == "example.com"
+    assert view.get("EMAIL") is None
+    assert view.get("CLOUDFLARE_API_TOKEN", "fallback") == "fallback"
+    assert view == {"DOMAIN": "example.com", "STAGING": "1"}
+
+
+def test_env_view_missing_file(tmp_path: Path):
+    view = c.EnvView(tmp_path / "missing.env")
+
+    assert view.get("DOMAIN") is None
+    assert len(view) == 0
+
+
+def test_load_env_file_does_not_log_token(tmp_path: Path, caplog):
+    env = tmp_path / ".env"
+    env.write_text("CLOUDFLARE_API_TOKEN=supersecret\n")
+
+    with caplog.at_level(logging.DEBUG):
+        c.load_env_file(env)
+
+    assert "supersecret" not in caplog.text
+
+
+def test_load_config_without_args_skips_argparse(monkeypatch, tmp_path):
+    (tmp_path / ".env").write_text("CLOUDFLARE_API_TOKEN=abc123\nDOMAIN=example.com\n")
+    monkeypatch.chdir(tmp_path)
+
+    monkeypatch.setattr("sys.argv", ["prog"])
+
+    def fail():
+        raise AssertionError("argparse should not be used")
+
+    monkeypatch.setattr(c, "_get_parser", fail)
+
+    config = c.load_config()
+
+    assert config["domain"] == "example.com"
+    assert config["api_token"] == "abc123"
+    assert config["staging"] is False
+
+
+def test_env_view_matches_load_env_file(tmp_path: Path):
+    env = tmp_path / ".env"
+    env.write_bytes(
+        b"  DOMAIN = \"example.com\"  \r\nEMAIL='admin@example.com'\nDOMAIN=x.com\nSTAGING=\n"
+    )
+
+    env_vars = c.load_env_file(env)
+
+    # Same parse, except EnvView reports empty values as unset
+    assert env_vars["STAGING"] == ""
+    assert "STAGING" not in c.EnvView(env)
+    assert c.EnvView(env) == {k: v for k, v in env_vars.items() if v}
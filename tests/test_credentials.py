@@ -6,7 +6,18 @@ def test_validate_credentials_missing(capsys):
 
     captured = capsys.readouterr()
     assert "CLOUDFLARE_API_TOKEN is required" in captured.err
+    assert captured.err.endswith("export CLOUDFLARE_API_TOKEN=your_token\n")
 
 
 def test_validate_credentials_ok():
     assert c.validate_credentials("abc123") is True
+
+
+def test_creds_dir_under_home(monkeypatch, tmp_path):
+    monkeypatch.setenv("HOME", str(tmp_path))
+    c._creds_dir.cache_clear()
+
+    try:
+        assert c._creds_dir() == str(tmp_path / ".secrets" / "certbot")
+    finally:
+        c._creds_dir.cache_clear()
@@ -11,6 +11,8 @@ def test_main_success(monkeypatch):
             "api_token": "abc123",
             "staging": False,
             "propagation_seconds": 10,
+            "verbose": False,
+            "force_issue": False,
         },
     )
 
@@ -30,6 +32,8 @@ def test_main_failure(monkeypatch):
             "api_token": "abc123",
             "staging": False,
             "propagation_seconds": 10,
+            "verbose": False,
+            "force_issue": False,
         },
     )
 
@@ -1,13 +1,22 @@
-import subprocess
+import pytest
 
 from cloudflare_request_cert import main as c
 
 
-def test_request_certificate_success(mocker, tmp_path, monkeypatch):
-    mock_run = mocker.patch("subprocess.run")
+@pytest.fixture(autouse=True)
+def spawn(mocker, tmp_path, monkeypatch):
+    """Keep certbot, the credentials dir and /etc/letsencrypt out of the tests."""
+    mock_spawn = mocker.patch("os.posix_spawnp", return_value=4242)
+    mocker.patch("os.waitpid", return_value=(4242, 0))
 
-    monkeypatch.setattr("pathlib.Path.home", lambda: tmp_path)
+    monkeypatch.setattr(c, "_creds_dir", lambda: str(tmp_path / ".secrets" / "certbot"))
+    monkeypatch.setattr(c, "_LIVE_DIR", str(tmp_path / "live"))
+    monkeypatch.setattr(c, "_RENEWAL_DIR", str(tmp_path / "renewal"))
 
+    return mock_spawn
+
+
+def test_request_certificate_success(spawn, tmp_path):
     rc = c.request_certificate(
         domain="example.com",
         email="admin@example.com",
@@ -17,14 +26,38 @@ def test_request_certificate_success(mocker, tmp_path, monkeypatch):
     )
 
     assert rc == 0
-    mock_run.assert_called_once()
-    assert (tmp_path / ".secrets" / "certbot" / "cloudflare.ini").exists() is False
+    spawn.assert_called_once()
+    credentials_file = tmp_path / ".secrets" / "certbot" / "cloudflare.ini"
+    assert credentials_file.read_text() == "dns_cloudflare_api_token = abc123\n"
+    assert credentials_file.stat().st_mode & 0o777 == 0o600
+
+
+def test_request_certificate_keeps_unchanged_credentials(mocker):
+    kwargs = {"domain": "example.com", "email": "admin@example.com", "api_token": "abc123"}
+    assert c.request_certificate(**kwargs) == 0
 
+    os_open = mocker.spy(c.os, "open")
+    assert c.request_certificate(**kwargs) == 0
+    os_open.assert_not_called()
 
-def test_request_certificate_subprocess_failure(mocker, tmp_path, monkeypatch):
-    mocker.patch("subprocess.run", side_effect=subprocess.CalledProcessError(1, "cmd"))
+    assert c.request_certificate(**{**kwargs, "api_token": "rotated"}) == 0
+    os_open.assert_called_once()
 
-    monkeypatch.setattr("pathlib.Path.home", lambda: tmp_path)
+
+def test_request_certificate_tightens_loose_credentials(tmp_path):
+    credentials_file = tmp_path / ".secrets" / "certbot" / "cloudflare.ini"
+    credentials_file.parent.mkdir(parents=True)
+    credentials_file.write_text("dns_cloudflare_api_token = abc123\n")
+    credentials_file.chmod(0o644)
+
+    rc = c.request_certificate(domain="example.com", email="admin@example.com", api_token="abc123")
+
+    assert rc == 0
+    assert credentials_file.stat().st_mode & 0o777 == 0o600
+
+
+def test_request_certificate_subprocess_failure(mocker):
+    mocker.patch("os.waitpid", return_value=(4242, 1 << 8))
 
     rc = c.request_certificate(
         domain="example.com",
@@ -35,3 +68,119 @@ def test_request_certificate_subprocess_failure(mocker, tmp_path, monkeypatch):
     )
 
     assert rc == 1
+
+
+def test_request_certificate_certbot_missing(spawn, capsys):
+    spawn.side_effect = FileNotFoundError
+
+    rc = c.request_certificate(
+        domain="example.com",
+        email="admin@example.com",
+        api_token="abc123",
+    )
+
+    assert rc == 1
+    assert "certbot not found" in capsys.readouterr().err
+
+
+def test_request_certificate_command(spawn, tmp_path):
+    c.request_certificate(
+        domain="example.com",
+        email="admin@example.com",
+        api_token="abc123",
+        staging=True,
+        propagation_seconds=30,
+    )
+
+    cmd = spawn.call_args.args[1]
+    assert cmd[1] == "certonly"
+    assert cmd[cmd.index("--dns-cloudflare-propagation-seconds") + 1] == "30"
+    assert cmd[cmd.index("--dns-cloudflare-credentials") + 1] == str(
+        tmp_path / ".secrets" / "certbot" / "cloudflare.ini"
+    )
+    assert cmd[cmd.index("-d") + 1] == "example.com"
+    assert cmd[cmd.index("--email") + 1] == "admin@example.com"
+    assert "--staging" in cmd
+    assert "--quiet" in cmd
+
+
+def test_request_certificate_verbose(spawn):
+    c.request_certificate(
+        domain="example.com",
+        email="admin@example.com",
+        api_token="abc123",
+        verbose=True,
+    )
+
+    assert "--quiet" not in spawn.call_args.args[1]
+
+
+def _make_lineage(tmp_path, server):
+    (tmp_path / "live" / "example.com").mkdir(parents=True)
+    (tmp_path / "live" / "example.com" / "fullchain.pem").touch()
+    (tmp_path / "renewal").mkdir()
+    (tmp_path / "renewal" / "example.com.conf").write_text(
+        f"version = 2.11.0\n\n[renewalparams]\nserver = {server}\n"
+    )
+
+
+def test_request_certificate_renews_existing(spawn, tmp_path):
+    _make_lineage(tmp_path, "https://acme-v02.api.letsencrypt.org/directory")
+
+    kwargs = {"domain": "example.com", "email": "admin@example.com", "api_token": "abc123"}
+    assert c.request_certificate(**kwargs) == 0
+
+    cmd = spawn.call_args.args[1]
+    assert cmd[1:4] == ["renew", "--cert-name", "example.com"]
+    assert (tmp_path / ".secrets" / "certbot" / "cloudflare.ini").exists()
+
+    assert c.request_certificate(**kwargs, force_issue=True) == 0
+    cmd = spawn.call_args.args[1]
+    assert cmd[1] == "certonly"
+    assert "--force-renewal" in cmd
+
+
+def test_request_certificate_force_issue_without_lineage(spawn):
+    kwargs = {"domain": "example.com", "email": "admin@example.com", "api_token": "abc123"}
+    assert c.request_certificate(**kwargs, force_issue=True) == 0
+
+    cmd = spawn.call_args.args[1]
+    assert cmd[1] == "certonly"
+    assert "--force-renewal" not in cmd
+
+
+def test_request_certificate_replaces_staging_with_production(spawn, tmp_path):
+    _make_lineage(tmp_path, "https://acme-staging-v02.api.letsencrypt.org/directory")
+
+    kwargs = {"domain": "example.com", "email": "admin@example.com", "api_token": "abc123"}
+    assert c.request_certificate(**kwargs) == 0
+
+    cmd = spawn.call_args.args[1]
+    assert cmd[1] == "certonly"
+    assert "--staging" not in cmd
+    assert "--force-renewal" in cmd
+
+    assert c.request_certificate(**kwargs, staging=True) == 0
+    assert spawn.call_args.args[1][1] == "renew"
+
+
+def test_request_certificate_staging_refuses_production_lineage(spawn, tmp_path, capsys):
+    _make_lineage(tmp_path, "https://acme-v02.api.letsencrypt.org/directory")
+
+    kwargs = {"domain": "example.com", "email": "admin@example.com", "api_token": "abc123"}
+    assert c.request_certificate(**kwargs, staging=True) == 1
+    assert c.request_certificate(**kwargs, staging=True, force_issue=True) == 1
+
+    spawn.assert_not_called()
+    err = capsys.readouterr().err
+    assert "production certificate for example.com already exists" in err
+    assert "certbot delete --cert-name example.com" in err
+
+
+def test_request_certificate_unreadable_renewal_config(spawn, tmp_path):
+    _make_lineage(tmp_path, "https://acme-v02.api.letsencrypt.org/directory")
+    (tmp_path / "renewal" / "example.com.conf").unlink()
+
+    kwargs = {"domain": "example.com", "email": "admin@example.com", "api_token": "abc123"}
+    assert c.request_certificate(**kwargs) == 0
+    assert spawn.call_args.args[1][1] == "certonly"
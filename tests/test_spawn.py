@@ -0,0 +1,6 @@
+from cloudflare_request_cert import main as c
+
+
+def test_spawn_certbot_exit_code():
+    assert c._spawn_certbot(["true"]) == 0
+    assert c._spawn_certbot(["false"]) == 1